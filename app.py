@@ -1,61 +1,199 @@
 import gradio as gr
+import asyncio
+import atexit
+import io
+import itertools
 import subprocess
 import os
+import queue
+import shutil
 import sqlite3
+import threading
 import uuid
 from datetime import datetime
+from pathlib import Path
 import logging
 
+from init_db import DB_FILE, initialize_db
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
-
-# --- Database configuration ---
-DB_FILE = "msa_history.db"
+logging.getLogger("gradio").setLevel(logging.WARNING)
+_log = logging.getLogger(__name__)
 
 # --- Directory Creation ---
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("results", exist_ok=True)
 
 # --- Database Function ---
-def save_to_db(session_id, task_id, tool, input_file, output_file, timestamp):
+def get_conn():
+    # Autocommit connection; WAL + synchronous=NORMAL avoids an fsync-heavy rollback journal.
+    # check_same_thread=False because Gradio runs handlers on a threadpool (access is guarded by _DB_LOCK).
+    # cached_statements keeps the compiled INSERT/SELECT around on the long-lived connection.
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA mmap_size=268435456") # 256 MiB: serve history reads from the page cache via mmap
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+# Create the schema (and any missing index) before the first connection uses it,
+# so no separate `python init_db.py` step is required
+initialize_db()
+
+# One process-wide connection instead of connect/close per request
+_DB_CONN = get_conn()
+_DB_LOCK = threading.Lock()
+
+# History cache: session_id -> (write counter at render time, rendered table).
+# _WRITE_COUNTER is bumped under _DB_LOCK on every insert, so an unchanged counter means the cached table is current.
+_HISTORY_CACHE_MAX = 1024
+_HISTORY_CACHE: dict[str, tuple[int, str]] = {}
+_WRITE_COUNTER: dict[str, int] = {}
+
+def save_many_to_db(rows):
+    # rows: iterable of (session_id, task_id, tool, input_file, output_file, timestamp)
+    # Written in one explicit transaction so a batch costs a single commit
+    rows = list(rows)
+    if not rows:
+        return True
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO history (session_id, task_id, tool, input_file, output_file, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (session_id, task_id, tool, input_file, output_file, timestamp))
-        conn.commit()
-        conn.close()
-        logging.info(f"Saved task {task_id} for session {session_id} to DB.")
+        with _DB_LOCK, _DB_CONN:
+            _DB_CONN.execute("BEGIN")
+            _DB_CONN.executemany('''
+                INSERT INTO history (session_id, task_id, tool, input_file, output_file, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            for row in rows:
+                _WRITE_COUNTER[row[0]] = _WRITE_COUNTER.get(row[0], 0) + 1
+        _log.info("Saved %s history row(s) to DB.", len(rows))
+        return True
     except sqlite3.Error as e:
-        logging.error(f"Database error saving task {task_id}: {e}")
+        _log.error("Database error saving %s history row(s): %s", len(rows), e)
+        return False
+
+# --- Background History Writer ---
+# Inserts are queued and committed by a single daemon thread, so the commit is off the request path.
+# The writer flushes whenever rows are waiting, at most _WRITE_BATCH_MAX rows per transaction.
+_WRITE_BATCH_MAX = 32
+_WRITE_POLL_INTERVAL = 0.05
+_WRITE_Q = queue.Queue()
+_WRITER_STOP = threading.Event()
+
+def _writer_loop():
+    while not (_WRITER_STOP.is_set() and _WRITE_Q.empty()):
+        try:
+            batch = [_WRITE_Q.get(timeout=_WRITE_POLL_INTERVAL)]
+        except queue.Empty:
+            continue
+        while len(batch) < _WRITE_BATCH_MAX:
+            try:
+                batch.append(_WRITE_Q.get_nowait())
+            except queue.Empty:
+                break
+        if not save_many_to_db(batch) and len(batch) > 1:
+            # Don't let one bad row (e.g. a duplicate task_id) drop the rest of the batch
+            for row in batch:
+                save_many_to_db([row])
+
+def _stop_writer():
+    # Flush whatever is still queued before the interpreter exits
+    _WRITER_STOP.set()
+    _WRITER_THREAD.join(timeout=5)
+
+_WRITER_THREAD = threading.Thread(target=_writer_loop, name="history-writer", daemon=True)
+_WRITER_THREAD.start()
+atexit.register(_stop_writer)
+
+def queue_history_rows(rows):
+    # Non-blocking; rows are committed by the background writer
+    for row in rows:
+        _WRITE_Q.put(row)
+
+# --- Tool Resolution ---
+# Resolve aligner binaries once at startup; absolute paths spare subprocess a PATH walk per run
+_TOOL_COMMANDS = {"MAFFT": "mafft", "MUSCLE": "muscle"}
+_TOOL_BINARIES = {tool: shutil.which(cmd) for tool, cmd in _TOOL_COMMANDS.items()}
+for _tool, _binary in _TOOL_BINARIES.items():
+    if _binary is None:
+        _log.warning("%s not found in PATH; %s alignments will be unavailable.", _tool, _tool)
+
+# --- Upload Handling ---
+def _materialize_upload(src, dst):
+    # The alignment tools only read the input, so avoid moving bytes when we can:
+    # hardlink first, and copy if cross-device (or no hardlink permission on Windows).
+    # Never symlink: Gradio's temp cache can be cleaned, which would leave archived inputs dangling.
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+# --- Result Preview ---
+# Only the head of the alignment is shown in the result box; the full file is offered for download
+_PREVIEW_LINES = 200
+_PREVIEW_TRUNCATED_NOTE = "\n...(结果已截断，请下载完整文件查看)"
+
+def _make_preview(lines):
+    # lines: iterable of bytes lines (an open binary file or io.BytesIO)
+    head = list(itertools.islice(lines, _PREVIEW_LINES + 1))
+    truncated = len(head) > _PREVIEW_LINES
+    preview = b"".join(head[:_PREVIEW_LINES]).decode(errors="replace")
+    return preview + _PREVIEW_TRUNCATED_NOTE if truncated else preview
+
+def _read_preview(path):
+    with open(path, "rb") as f:
+        return _make_preview(f)
 
 # --- Core Logic ---
+# Alignment is CPU and memory heavy; this is the run button's concurrency_limit, so the
+# Gradio queue holds extra jobs back instead of letting them contend for CPU and memory
+_ALIGN_MAX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+async def _run_command(command):
+    # Run the aligner without blocking the event loop; mirror subprocess.run(check=True) on failure
+    proc = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command, output=stdout, stderr=stderr)
+    return stdout, stderr
+
 # Modified session_state handling
-def run_alignment(fasta_file_obj, tool, current_session_state, progress=gr.Progress(track_tqdm=True)):
+async def run_alignment(fasta_file_obj, tool, current_session_state, progress=gr.Progress(track_tqdm=True)):
     # Add a check for None state, although initializing should prevent it
     if current_session_state is None:
-        logging.error("Session state received as None in run_alignment!")
+        _log.error("Session state received as None in run_alignment!")
         current_session_state = {} # Initialize if None unexpectedly
 
-    logging.info(f"Received state in run_alignment: {current_session_state}")
+    _log.info("Received state in run_alignment: %s", current_session_state)
 
     if fasta_file_obj is None:
         return "请上传FASTA文件。", None, "错误：未上传文件"
 
+    if tool not in _TOOL_BINARIES:
+        return "无效的比对工具选择。", None, "错误：无效工具"
+    binary = _TOOL_BINARIES[tool]
+    if binary is None:
+        cmd = _TOOL_COMMANDS[tool]
+        return f"错误: 命令 '{cmd}' 未找到。请确保 {tool} 已安装并已添加到系统 PATH。", None, f"错误：{tool} 未找到"
+
     # Use dictionary access (.get, []) on the state dictionary
     session_id = current_session_state.get('session_id')
 
     if session_id is None:
         session_id = str(uuid.uuid4())
         current_session_state['session_id'] = session_id # Store ID in the dictionary
-        logging.info(f"New session created and stored in state: {session_id}")
+        _log.info("New session created and stored in state: %s", session_id)
     else:
-        logging.info(f"Using existing session from state: {session_id}")
+        _log.info("Using existing session from state: %s", session_id)
 
-    task_id = uuid.uuid4().hex
-    timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    task_id = os.urandom(16).hex() # Same 32 hex chars as uuid4().hex without the version-bit masking
+    now = datetime.now() # One clock read for both the filenames and the history row
+    timestamp_str = now.strftime("%Y%m%d_%H%M%S")
+    timestamp_iso = now.isoformat()
 
     input_filename = f"input_{task_id}_{timestamp_str}.fasta"
     output_filename = f"result_{task_id}_{timestamp_str}.aln"
@@ -66,11 +204,11 @@ def run_alignment(fasta_file_obj, tool, current_session_state, progress=gr.Progr
         # Check if fasta_file_obj has 'name' attribute (should be TemporaryFileWrapper)
         if not hasattr(fasta_file_obj, 'name'):
              raise TypeError("Invalid file object received.")
-        with open(fasta_file_obj.name, "rb") as infile, open(input_path, "wb") as outfile:
-             outfile.write(infile.read())
-        logging.info(f"Input file saved to {input_path}")
+        # The copy fallback is O(filesize), so keep it off the event loop
+        await asyncio.to_thread(_materialize_upload, fasta_file_obj.name, input_path)
+        _log.info("Input file saved to %s", input_path)
     except (AttributeError, TypeError, Exception) as e:
-        logging.error(f"Error saving uploaded file: {e}")
+        _log.error("Error saving uploaded file: %s", e)
         return f"处理上传文件时出错: {e}", None, "错误：文件保存失败"
 
     progress(0.1, desc="准备运行比对...")
@@ -79,46 +217,53 @@ def run_alignment(fasta_file_obj, tool, current_session_state, progress=gr.Progr
     try:
         command = []
         if tool == "MAFFT":
-            command = ["mafft", "--quiet", input_path]
+            command = [binary, "--quiet", input_path]
             progress(0.2, desc=f"运行 {tool}...")
-            with open(output_path, "w") as f_out:
-                result = subprocess.run(command, stdout=f_out, stderr=subprocess.PIPE, text=True, check=True)
-                logging.info(f"MAFFT completed for task {task_id}.")
+            stdout, _ = await _run_command(command)
+            # Write the alignment once and build the preview from memory instead of re-reading the file
+            result_text = _make_preview(io.BytesIO(stdout))
+            await asyncio.to_thread(Path(output_path).write_bytes, stdout)
+            _log.info("MAFFT completed for task %s.", task_id)
         elif tool == "MUSCLE":
             # Check Muscle version? V3 uses -in/-out, V5 uses different flags like --align/--output
-            command = ["muscle", "-in", input_path, "-out", output_path]
-            logging.warning("Assuming MUSCLE v3 syntax (-in/-out). Adjust if using MUSCLE v5.")
+            command = [binary, "-in", input_path, "-out", output_path]
+            _log.warning("Assuming MUSCLE v3 syntax (-in/-out). Adjust if using MUSCLE v5.")
             progress(0.2, desc=f"运行 {tool}...")
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-            logging.info(f"MUSCLE completed for task {task_id}. Stdout: {result.stdout}, Stderr: {result.stderr}")
-        else:
-             return "无效的比对工具选择。", None, "错误：无效工具"
+            stdout, stderr = await _run_command(command)
+            if _log.isEnabledFor(logging.INFO):
+                _log.info("MUSCLE completed for task %s. Stdout: %s, Stderr: %s",
+                          task_id, stdout.decode(errors="replace"), stderr.decode(errors="replace"))
 
     except FileNotFoundError:
-        logging.error(f"Error: Command '{command[0]}' not found. Is {tool} installed and in PATH?")
+        _log.error("Error: Command '%s' not found. Is %s installed and in PATH?", command[0], tool)
         return f"错误: 命令 '{command[0]}' 未找到。请确保 {tool} 已安装并已添加到系统 PATH。", None, f"错误：{tool} 未找到"
     except subprocess.CalledProcessError as e:
-        logging.error(f"Error running {tool} for task {task_id}. Return code: {e.returncode}")
-        logging.error(f"Stderr: {e.stderr}")
+        _log.error("Error running %s for task %s. Return code: %s", tool, task_id, e.returncode)
+        stderr_text = e.stderr.decode(errors="replace") if e.stderr else ""
+        stdout_text = e.stdout.decode(errors="replace") if e.stdout else ""
+        _log.error("Stderr: %s", stderr_text)
         # Try to provide more specific error if possible
-        error_detail = e.stderr or e.stdout or f"Return code: {e.returncode}"
+        error_detail = stderr_text or stdout_text or f"Return code: {e.returncode}"
         return f"{tool} 运行时出错。\n错误信息:\n{error_detail}", None, f"错误：{tool} 运行失败"
     except Exception as e:
-        logging.error(f"An unexpected error occurred during alignment: {e}")
+        _log.error("An unexpected error occurred during alignment: %s", e)
         return f"比对过程中发生意外错误: {e}", None, "错误：比对异常"
 
     progress(0.9, desc="比对完成，读取结果...")
     status_message = f"比对完成 ({tool})。"
 
-    try:
-        with open(output_path, "r") as f:
-            result_text = f.read()
-        logging.info(f"Result file {output_path} read successfully.")
-    except Exception as e:
-        logging.error(f"Error reading result file {output_path}: {e}")
-        return "比对成功，但读取结果文件时出错。", None, "错误：结果读取失败"
+    # MUSCLE writes its own output file; MAFFT's preview is already built from memory
+    if tool == "MUSCLE":
+        try:
+            result_text = await asyncio.to_thread(_read_preview, output_path)
+            _log.info("Result file %s read successfully.", output_path)
+        except Exception as e:
+            _log.error("Error reading result file %s: %s", output_path, e)
+            return "比对成功，但读取结果文件时出错。", None, "错误：结果读取失败"
 
-    save_to_db(session_id, task_id, tool, input_path, output_path, datetime.now().isoformat())
+    # Collect this task's history rows; the background writer commits them in one transaction
+    history_rows = [(session_id, task_id, tool, input_path, output_path, timestamp_iso)]
+    queue_history_rows(history_rows)
 
     # IMPORTANT: Return the updated state dictionary so Gradio persists it
     # However, gr.State() is designed to update implicitly when mutated.
@@ -127,14 +272,16 @@ def run_alignment(fasta_file_obj, tool, current_session_state, progress=gr.Progr
     return result_text, gr.update(value=output_path), status_message
 
 # --- History Function ---
+_HISTORY_HEADER = "时间\t工具\t输入文件\t输出文件\n" + "-"*50 + "\n"
+
 # Modified session_state handling
 def show_history(current_session_state):
     # Add a check for None state
     if current_session_state is None:
-        logging.error("Session state received as None in show_history!")
+        _log.error("Session state received as None in show_history!")
         current_session_state = {}
 
-    logging.info(f"Received state in show_history: {current_session_state}")
+    _log.info("Received state in show_history: %s", current_session_state)
 
     # Use dictionary access (.get)
     session_id = current_session_state.get('session_id')
@@ -143,28 +290,37 @@ def show_history(current_session_state):
         return "当前会话没有历史记录。"
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("""
-            SELECT timestamp, tool,
-                   REPLACE(input_file, 'uploads/', '') as input,
-                   REPLACE(output_file, 'results/', '') as output
-            FROM history
-            WHERE session_id = ?
-            ORDER BY id DESC
-            LIMIT 20
-        """, (session_id,))
-        rows = c.fetchall()
-        conn.close()
+        with _DB_LOCK:
+            counter = _WRITE_COUNTER.get(session_id, 0)
+            cached = _HISTORY_CACHE.get(session_id)
+            if cached is not None and cached[0] == counter:
+                # Move to the end so a hit counts as recent use
+                _HISTORY_CACHE[session_id] = _HISTORY_CACHE.pop(session_id)
+                return cached[1]
+            rows = _DB_CONN.execute("""
+                SELECT timestamp, tool, input_file, output_file
+                FROM history
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT 20
+            """, (session_id,)).fetchall()
     except sqlite3.Error as e:
-        logging.error(f"Database error fetching history for session {session_id}: {e}")
+        _log.error("Database error fetching history for session %s: %s", session_id, e)
         return f"无法加载历史记录: {e}"
 
     if not rows:
-        return f"当前会话 (ID: ...{session_id[-6:]}) 没有历史记录。" # Show partial ID for confirmation
-
-    header = "时间\t工具\t输入文件\t输出文件\n" + "-"*50 + "\n"
-    table = header + "\n".join(["\t".join(map(str, row)) for row in rows])
+        table = f"当前会话 (ID: ...{session_id[-6:]}) 没有历史记录。" # Show partial ID for confirmation
+    else:
+        # Strip the directory prefixes here rather than per row in SQL
+        rows = [(ts, t, i.removeprefix("uploads/"), o.removeprefix("results/")) for ts, t, i, o in rows]
+        table = _HISTORY_HEADER + "\n".join("\t".join(map(str, row)) for row in rows)
+
+    with _DB_LOCK:
+        # Re-insert so dict order tracks recency; the first key is then the least recently used session
+        _HISTORY_CACHE.pop(session_id, None)
+        if len(_HISTORY_CACHE) >= _HISTORY_CACHE_MAX:
+            _HISTORY_CACHE.pop(next(iter(_HISTORY_CACHE)))
+        _HISTORY_CACHE[session_id] = (counter, table)
     return table
 
 
@@ -196,7 +352,10 @@ with gr.Blocks() as demo:
         fn=run_alignment,
         inputs=[file_input, tool_select, session_state], # Pass state object
         # Do NOT list session_state in outputs unless you explicitly return it AND need to overwrite
-        outputs=[result_box, file_download, status_output]
+        outputs=[result_box, file_download, status_output],
+        # Gradio defaults each listener to one concurrent run; allow several alignments side by side,
+        # up to half the CPUs, with the rest waiting in the Gradio queue
+        concurrency_limit=_ALIGN_MAX_WORKERS
     )
 
     history_button.click(
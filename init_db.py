@@ -4,21 +4,32 @@ DB_FILE = "msa_history.db"
 
 def initialize_db():
     conn = sqlite3.connect(DB_FILE)
+    # WAL is persisted in the database file, so app.py connections inherit it
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            task_id TEXT NOT NULL UNIQUE,
-            tool TEXT NOT NULL,
-            input_file TEXT NOT NULL,
-            output_file TEXT NOT NULL,
-            timestamp TEXT NOT NULL
-        )
-    ''')
+    # Fast path: skip the CREATE TABLE when the schema is already in place
+    table_exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='history'"
+    ).fetchone()
+    if not table_exists:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                task_id TEXT NOT NULL UNIQUE,
+                tool TEXT NOT NULL,
+                input_file TEXT NOT NULL,
+                output_file TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            )
+        ''')
+    # Serves show_history's "WHERE session_id = ? ORDER BY id DESC LIMIT 20" without a scan + sort.
+    # Kept outside the fast path so databases created before the index still get it.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_session ON history(session_id, id DESC)")
     conn.commit()
     conn.close()
     print(f"Database {DB_FILE} initialized.")
 
-initialize_db()
-
+if __name__ == "__main__":
+    initialize_db()